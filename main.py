@@ -16,6 +16,7 @@ Este script:
 import os
 import sys
 import logging
+import logging.handlers
 import asyncio
 from dotenv import load_dotenv
 
@@ -25,22 +26,30 @@ from services.email_service import EmailService
 from services.notifications import NotificationManager
 from services.order_processor import OrderProcessor
 
-# Cargar variables de entorno
+# Cargar variables de entorno (una sola vez por proceso; los servicios
+# comprueban _ENV_LOADED para no re-parsear el .env)
 load_dotenv()
+os.environ["_ENV_LOADED"] = "1"
 
 # Configurar logging
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 LOG_FILE = os.getenv("LOG_FILE", "logs/confirmation_shipment.log")
 
-# Crear directorio de logs si no existe
-os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+# Crear directorio de logs si no existe (comprobar primero: la ruta rápida
+# en ejecuciones periódicas es que ya exista)
+if not os.path.isdir(os.path.dirname(LOG_FILE)):
+    os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
 
-# Configurar logger
+# Configurar logger con rotación para acotar el uso de disco (el script
+# corre por cron y el log crecía sin límite). delay=True pospone abrir el
+# fichero hasta el primer registro emitido.
 logging.basicConfig(
     level=getattr(logging, LOG_LEVEL),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler(LOG_FILE, encoding='utf-8'),
+        logging.handlers.RotatingFileHandler(
+            LOG_FILE, maxBytes=10_000_000, backupCount=5,
+            encoding='utf-8', delay=True),
         logging.StreamHandler(sys.stdout)
     ]
 )
@@ -84,8 +93,16 @@ def main():
             notification_manager=notification_manager
         )
 
-        # Ejecutar proceso
-        asyncio.run(processor.process_all_orders_async())
+        async def run():
+            try:
+                await processor.process_all_orders_async()
+            finally:
+                # Liberar la sesión compartida de Slack al terminar
+                await notification_manager.close()
+
+        # Ejecutar proceso (la conexión SMTP se cierra al salir del with)
+        with email_service:
+            asyncio.run(run())
 
     except KeyboardInterrupt:
         logger.info("Proceso interrumpido por el usuario")
@@ -4,22 +4,63 @@ Incluye generación de plantillas y envío mediante SMTP.
 Soporta dos modos: development (envía a email de prueba) y production (envía a clientes).
 """
 
+import asyncio
+import hashlib
+import json
 import logging
+import os
+import time
 import requests
 import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+import aiohttp
+import aiosmtplib
+from email.message import EmailMessage
+from email.policy import SMTP as SMTP_POLICY
 from typing import Dict, Any, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger("ConfirmationShipmentLogger")
 
+# Centinela para distinguir "no hay entrada en caché" de una caché negativa
+_CACHE_MISS = object()
+
 
 class EmailService:
     """Servicio para manejo de emails de confirmación de envíos."""
 
+    # Atributos fijos: acceso más rápido que vía __dict__ y menos memoria
+    # por instancia
+    __slots__ = (
+        "smtp_server", "smtp_port", "sender_email", "sender_password",
+        "template_api_url", "bcc_email", "environment", "dev_test_email",
+        "pool_size", "max_messages_per_conn",
+        "_smtp", "_smtp_pool", "_prod_bcc_list", "_http", "_aio_session",
+        "_template_cache_enabled", "_template_cache_dir",
+        "_template_cache", "_template_negative_until",
+        "_breaker_failures", "_breaker_open_until",
+    )
+
+    # TTL de la caché de plantillas: 7 días para respuestas válidas,
+    # 60 segundos para fallos (sobrevivir ráfagas de 5xx de la API)
+    TEMPLATE_CACHE_TTL = 7 * 24 * 3600
+    TEMPLATE_NEGATIVE_CACHE_TTL = 60
+
+    # Reintentos hacia la API de plantillas: 3 intentos con backoff
+    # exponencial (0.5s, 1s, 2s; tope 4s) solo ante errores de red
+    TEMPLATE_RETRY_ATTEMPTS = 3
+    TEMPLATE_RETRY_BACKOFF = 0.5
+    TEMPLATE_RETRY_MAX_WAIT = 4
+
+    # Circuit breaker: tras 5 fallos consecutivos se deja de llamar a la
+    # API durante 60s en vez de agotar el timeout de 30s pedido a pedido
+    BREAKER_FAIL_MAX = 5
+    BREAKER_RESET_TIMEOUT = 60
+
     def __init__(self, smtp_server: str, smtp_port: int, sender_email: str,
                  sender_password: str, template_api_url: str, bcc_email: str = None,
-                 environment: str = "production", dev_test_email: str = None):
+                 environment: str = "production", dev_test_email: str = None,
+                 pool_size: int = 5, max_messages_per_conn: int = 100):
         """
         Inicializa el servicio de email.
 
@@ -32,6 +73,9 @@ class EmailService:
             bcc_email: Email para copia oculta (opcional)
             environment: Entorno (development/production)
             dev_test_email: Email de prueba para desarrollo
+            pool_size: Número de conexiones SMTP concurrentes (Office365
+                limita a ~10 sesiones simultáneas, por eso el valor por defecto es 5)
+            max_messages_per_conn: Mensajes por conexión antes de reciclarla
         """
         self.smtp_server = smtp_server
         self.smtp_port = smtp_port
@@ -42,16 +86,312 @@ class EmailService:
         self.environment = environment.lower()
         self.dev_test_email = dev_test_email
 
+        # Conexión SMTP persistente (se abre de forma perezosa en el primer envío)
+        self._smtp = None
+
+        # BCC precomputado para producción: evita reconstruir la lista de
+        # destinatarios en cada envío
+        self._prod_bcc_list = (self.bcc_email,) if self.bcc_email else ()
+
+        # Pool de conexiones SMTP asíncronas para envíos concurrentes.
+        # La cola se llena de forma perezosa en el primer envío asíncrono.
+        self.pool_size = pool_size
+        self.max_messages_per_conn = max_messages_per_conn
+        self._smtp_pool = None
+
+        # Caché de plantillas HTML por hash del payload. Evita repetir la
+        # llamada a la API de plantillas para entradas idénticas (reintentos,
+        # ejecuciones repetidas del mismo día). Desactivable vía env var.
+        self._template_cache_enabled = os.getenv(
+            "TEMPLATE_CACHE_ENABLED", "true").lower() == "true"
+        self._template_cache_dir = os.getenv(
+            "TEMPLATE_CACHE_DIR", "cache/templates")
+        self._template_cache = {}
+        self._template_negative_until = {}
+
+        # Estado del circuit breaker de la API de plantillas
+        self._breaker_failures = 0
+        self._breaker_open_until = 0.0
+
+        # Sesión HTTP compartida con pool de conexiones: reutiliza el socket
+        # TLS hacia la API de plantillas en lugar de abrir uno por pedido
+        self._http = requests.Session()
+        self._http.mount("https://", HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=10,
+            max_retries=Retry(total=3, backoff_factor=0.3,
+                              status_forcelist=[502, 503, 504])
+        ))
+
+        # Sesión aiohttp compartida para la generación asíncrona de
+        # plantillas (se crea de forma perezosa en el primer uso)
+        self._aio_session = None
+
         if self.environment == "development":
-            logger.info(f"EmailService iniciado en modo DEVELOPMENT - Los emails se enviarán a: {self.dev_test_email}")
+            logger.info("EmailService iniciado en modo DEVELOPMENT - Los emails se enviarán a: %s", self.dev_test_email)
         else:
             logger.info("EmailService iniciado en modo PRODUCTION - Los emails se enviarán a los clientes")
 
+    def open(self):
+        """
+        Abre y autentica la conexión SMTP si aún no está abierta.
+
+        Reutilizar una única conexión autenticada para todo el lote evita
+        repetir el handshake STARTTLS + LOGIN en cada pedido.
+        """
+        if self._smtp is not None:
+            return
+
+        logger.debug("Abriendo conexión SMTP con %s:%s", self.smtp_server, self.smtp_port)
+        smtp = smtplib.SMTP(self.smtp_server, self.smtp_port)
+        smtp.starttls()
+        smtp.login(self.sender_email, self.sender_password)
+        self._smtp = smtp
+        logger.info("Conexión SMTP establecida con %s", self.smtp_server)
+
+    def close(self):
+        """Cierra la conexión SMTP y la sesión HTTP si están abiertas."""
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+                logger.debug("Conexión SMTP cerrada correctamente")
+            except Exception as e:
+                logger.debug("Error al cerrar conexión SMTP (se ignora): %s", e)
+            finally:
+                self._smtp = None
+
+        self._http.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def _send_with_retry(self, recipients, msg: EmailMessage):
+        """
+        Envía el mensaje por la conexión persistente.
+
+        Si el servidor cerró la conexión (timeout de inactividad), la reabre
+        una única vez y reintenta el envío.
+        """
+        self.open()
+
+        try:
+            self._smtp.send_message(msg, from_addr=self.sender_email,
+                                    to_addrs=recipients)
+        except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError) as e:
+            logger.warning("Conexión SMTP perdida (%s), reconectando...", e)
+            self._smtp = None
+            self.open()
+            self._smtp.send_message(msg, from_addr=self.sender_email,
+                                    to_addrs=recipients)
+
+    def _template_cache_key(self, payload: Dict[str, Any]) -> str:
+        """Calcula la clave de caché a partir del hash del payload."""
+        serialized = json.dumps(payload, sort_keys=True, default=str)
+        return hashlib.blake2b(serialized.encode("utf-8"), digest_size=16).hexdigest()
+
+    def _template_cache_get(self, key: str) -> Optional[str]:
+        """
+        Busca una plantilla en caché (memoria primero, disco después).
+
+        Returns:
+            HTML cacheado o None si no hay entrada vigente
+        """
+        entry = self._template_cache.get(key)
+        if entry is not None:
+            html_content, expires_at = entry
+            if time.time() < expires_at:
+                return html_content
+            del self._template_cache[key]
+
+        # Buscar en disco (sobrevive entre ejecuciones del script)
+        cache_file = os.path.join(self._template_cache_dir, f"{key}.json")
+        try:
+            with open(cache_file, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            if time.time() < entry.get("expires_at", 0):
+                self._template_cache[key] = (entry["html"], entry["expires_at"])
+                return entry["html"]
+            os.remove(cache_file)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.debug("Entrada de caché de plantillas ilegible (%s): %s", key, e)
+
+        return None
+
+    def _template_cache_put(self, key: str, html_content: str):
+        """Guarda una plantilla en caché (memoria y disco)."""
+        expires_at = time.time() + self.TEMPLATE_CACHE_TTL
+        self._template_cache[key] = (html_content, expires_at)
+
+        try:
+            os.makedirs(self._template_cache_dir, exist_ok=True)
+            cache_file = os.path.join(self._template_cache_dir, f"{key}.json")
+            with open(cache_file, "w", encoding="utf-8") as f:
+                json.dump({"html": html_content, "expires_at": expires_at}, f)
+        except Exception as e:
+            logger.debug("No se pudo persistir la caché de plantillas: %s", e)
+
+    def _breaker_allows(self) -> bool:
+        """Indica si el circuito permite llamar a la API de plantillas."""
+        return time.time() >= self._breaker_open_until
+
+    def _breaker_record_success(self):
+        """Registra un éxito: cierra el circuito."""
+        self._breaker_failures = 0
+
+    def _breaker_record_failure(self):
+        """
+        Registra un fallo consecutivo y abre el circuito al llegar al límite.
+
+        La transición a abierto se registra una sola vez en el log; los
+        pedidos posteriores fallan rápido sin esperar el timeout de 30s.
+        """
+        self._breaker_failures += 1
+
+        if self._breaker_failures >= self.BREAKER_FAIL_MAX:
+            self._breaker_open_until = time.time() + self.BREAKER_RESET_TIMEOUT
+            logger.error(
+                "API de plantillas: %s fallos consecutivos, circuito abierto durante %ss",
+                self._breaker_failures, self.BREAKER_RESET_TIMEOUT)
+            self._breaker_failures = 0
+
+    def _retry_wait(self, attempt: int) -> float:
+        """Segundos de espera antes del reintento número attempt (desde 1)."""
+        return min(self.TEMPLATE_RETRY_BACKOFF * (2 ** (attempt - 1)),
+                   self.TEMPLATE_RETRY_MAX_WAIT)
+
+    def _post_template_with_retry(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Hace el POST a la API de plantillas con reintentos ante errores de red.
+
+        Returns:
+            Respuesta JSON de la API (lanza la última excepción si se agotan
+            los reintentos)
+        """
+        for attempt in range(1, self.TEMPLATE_RETRY_ATTEMPTS + 1):
+            try:
+                response = self._http.post(
+                    self.template_api_url,
+                    json=payload,
+                    timeout=30
+                )
+                response.raise_for_status()
+                return response.json()
+            except (requests.Timeout, requests.ConnectionError) as e:
+                if attempt == self.TEMPLATE_RETRY_ATTEMPTS:
+                    raise
+                wait = self._retry_wait(attempt)
+                logger.warning(
+                    "Error de red con la API de plantillas (%s), reintento %s/%s en %.1fs",
+                    e, attempt, self.TEMPLATE_RETRY_ATTEMPTS - 1, wait)
+                time.sleep(wait)
+
+    async def _post_template_with_retry_async(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Versión asíncrona de _post_template_with_retry."""
+        session = await self._get_aio_session()
+
+        for attempt in range(1, self.TEMPLATE_RETRY_ATTEMPTS + 1):
+            try:
+                async with session.post(
+                    self.template_api_url,
+                    json=payload,
+                    timeout=aiohttp.ClientTimeout(total=30)
+                ) as response:
+                    response.raise_for_status()
+                    return await response.json()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt == self.TEMPLATE_RETRY_ATTEMPTS:
+                    raise
+                wait = self._retry_wait(attempt)
+                logger.warning(
+                    "Error de red con la API de plantillas (%s), reintento %s/%s en %.1fs",
+                    e, attempt, self.TEMPLATE_RETRY_ATTEMPTS - 1, wait)
+                await asyncio.sleep(wait)
+
+    def _template_cache_lookup(self, payload: Dict[str, Any], order_id: Any):
+        """
+        Consulta la caché de plantillas para un payload.
+
+        Returns:
+            Tupla (clave, resultado) donde resultado es el HTML cacheado,
+            None si hay caché negativa vigente, o _CACHE_MISS si hay que
+            llamar a la API
+        """
+        if not self._template_cache_enabled:
+            return None, _CACHE_MISS
+
+        cache_key = self._template_cache_key(payload)
+
+        cached_html = self._template_cache_get(cache_key)
+        if cached_html is not None:
+            logger.debug("Plantilla para pedido %s servida desde caché", order_id)
+            return cache_key, cached_html
+
+        # Caché negativa: no martillear la API si acaba de fallar
+        if time.time() < self._template_negative_until.get(cache_key, 0):
+            logger.warning(
+                "Generación de plantilla para pedido %s omitida por fallo reciente de la API",
+                order_id)
+            return cache_key, None
+
+        return cache_key, _CACHE_MISS
+
+    def _template_cache_mark_failure(self, cache_key: Optional[str]):
+        """Activa la caché negativa para la clave indicada."""
+        if cache_key is not None:
+            self._template_negative_until[cache_key] = (
+                time.time() + self.TEMPLATE_NEGATIVE_CACHE_TTL)
+
+    def _process_template_result(self, result: Dict[str, Any],
+                                 cache_key: Optional[str]) -> Optional[str]:
+        """
+        Extrae y cachea el HTML de la respuesta de la API de plantillas.
+
+        Args:
+            result: Respuesta JSON de la API
+            cache_key: Clave de caché (None si la caché está desactivada)
+
+        Returns:
+            HTML del email o None si la respuesta no trae contenido
+        """
+        # Debug: Mostrar estructura de la respuesta
+        logger.debug("Estructura de respuesta de API: %s", list(result.keys()))
+
+        # La API devuelve el HTML directamente en 'html' o en 'body.html'
+        # Intentar ambas estructuras para compatibilidad
+        html_content = result.get("html") or result.get("body", {}).get("html")
+
+        if not html_content:
+            logger.error("La API no devolvió contenido HTML")
+            logger.error("Respuesta completa: %s", str(result)[:500])
+            logger.error("Claves disponibles: %s", list(result.keys()))
+            self._template_cache_mark_failure(cache_key)
+            return None
+
+        # Verificar que el pedido se procesó correctamente
+        if not result.get("success", True):
+            logger.warning("La API indicó un problema: %s", result.get('error', 'Error desconocido'))
+
+        logger.debug("HTML generado correctamente, longitud: %s caracteres", len(html_content))
+
+        if cache_key is not None:
+            self._template_cache_put(cache_key, html_content)
+
+        return html_content
+
     def generate_email_template(self, order: Dict[str, Any], customer: Dict[str, Any],
                                 address: Dict[str, Any]) -> Optional[str]:
         """
         Genera el HTML del email usando la API de plantillas.
 
+        Las respuestas se cachean por hash del payload, por lo que entradas
+        idénticas (reintentos o re-ejecuciones) no repiten la llamada HTTP.
+
         Args:
             order: Datos del pedido
             customer: Datos del cliente
@@ -60,48 +400,89 @@ class EmailService:
         Returns:
             HTML del email o None si hay error
         """
+        payload = {
+            "order": order,
+            "customer": customer,
+            "address": address
+        }
+
+        cache_key, cached = self._template_cache_lookup(payload, order.get("id"))
+        if cached is not _CACHE_MISS:
+            return cached
+
+        if not self._breaker_allows():
+            logger.warning(
+                "Circuito de la API de plantillas abierto, se omite el pedido %s",
+                order.get("id"))
+            return None
+
         try:
-            logger.debug(
-                f"Generando plantilla de email para pedido {order.get('id')}")
-
-            payload = {
-                "order": order,
-                "customer": customer,
-                "address": address
-            }
-
-            response = requests.post(
-                self.template_api_url,
-                json=payload,
-                timeout=30
+            logger.debug("Generando plantilla de email para pedido %s", order.get('id'))
+
+            result = self._post_template_with_retry(payload)
+            self._breaker_record_success()
+
+            return self._process_template_result(result, cache_key)
+
+        except Exception as e:
+            logger.error("Error al generar plantilla de email: %s", e)
+            self._breaker_record_failure()
+            self._template_cache_mark_failure(cache_key)
+            return None
+
+    async def _get_aio_session(self) -> aiohttp.ClientSession:
+        """Devuelve la sesión aiohttp compartida, creándola si es necesario."""
+        if self._aio_session is None or self._aio_session.closed:
+            self._aio_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=10, ttl_dns_cache=300)
             )
-            response.raise_for_status()
+        return self._aio_session
 
-            # Parsear respuesta JSON
-            result = response.json()
+    async def generate_email_template_async(self, order: Dict[str, Any],
+                                            customer: Dict[str, Any],
+                                            address: Dict[str, Any]) -> Optional[str]:
+        """
+        Versión asíncrona de generate_email_template.
 
-            # Debug: Mostrar estructura de la respuesta
-            logger.debug(f"Estructura de respuesta de API: {list(result.keys())}")
+        No bloquea el event loop durante la llamada a la API de plantillas,
+        por lo que varios pedidos pueden renderizar su plantilla en paralelo.
 
-            # La API devuelve el HTML directamente en 'html' o en 'body.html'
-            # Intentar ambas estructuras para compatibilidad
-            html_content = result.get("html") or result.get("body", {}).get("html")
+        Args:
+            order: Datos del pedido
+            customer: Datos del cliente
+            address: Datos de la dirección
 
-            if not html_content:
-                logger.error("La API no devolvió contenido HTML")
-                logger.error(f"Respuesta completa: {str(result)[:500]}")
-                logger.error(f"Claves disponibles: {list(result.keys())}")
-                return None
+        Returns:
+            HTML del email o None si hay error
+        """
+        payload = {
+            "order": order,
+            "customer": customer,
+            "address": address
+        }
+
+        cache_key, cached = self._template_cache_lookup(payload, order.get("id"))
+        if cached is not _CACHE_MISS:
+            return cached
+
+        if not self._breaker_allows():
+            logger.warning(
+                "Circuito de la API de plantillas abierto, se omite el pedido %s",
+                order.get("id"))
+            return None
+
+        try:
+            logger.debug("Generando plantilla de email para pedido %s", order.get('id'))
 
-            # Verificar que el pedido se procesó correctamente
-            if not result.get("success", True):
-                logger.warning(f"La API indicó un problema: {result.get('error', 'Error desconocido')}")
+            result = await self._post_template_with_retry_async(payload)
+            self._breaker_record_success()
 
-            logger.debug(f"HTML generado correctamente, longitud: {len(html_content)} caracteres")
-            return html_content
+            return self._process_template_result(result, cache_key)
 
         except Exception as e:
-            logger.error(f"Error al generar plantilla de email: {e}")
+            logger.error("Error al generar plantilla de email: %s", e)
+            self._breaker_record_failure()
+            self._template_cache_mark_failure(cache_key)
             return None
 
     def send_shipment_confirmation_email(self, customer_email: str, order_reference: str,
@@ -121,51 +502,240 @@ class EmailService:
             True si se envió correctamente, False en caso contrario
         """
         try:
-            # Determinar el destinatario según el entorno
-            if self.environment == "development":
-                if not self.dev_test_email:
-                    logger.error("Modo development activo pero dev_test_email no configurado")
-                    return False
+            msg, recipients = self._build_shipment_message(
+                customer_email, order_reference, html_content)
+            if msg is None:
+                return False
+
+            # Enviar email por la conexión persistente
+            self._send_with_retry(recipients, msg)
+
+            logger.info("Email de confirmación de envío enviado correctamente desde %s", self.sender_email)
+            return True
+
+        except Exception as e:
+            logger.error("Error al enviar email: %s", e)
+            return False
+
+    def _build_shipment_message(self, customer_email: str, order_reference: str,
+                                html_content: str):
+        """
+        Construye el mensaje MIME y la lista de destinatarios según el entorno.
+
+        Returns:
+            Tupla (mensaje, destinatarios) o (None, None) si falta configuración
+        """
+        # Determinar el destinatario según el entorno
+        if self.environment == "development":
+            if not self.dev_test_email:
+                logger.error("Modo development activo pero dev_test_email no configurado")
+                return None, None
+
+            recipient_email = self.dev_test_email
+            logger.info("[DEVELOPMENT] Enviando email de confirmación de envío del pedido %s", order_reference)
+            logger.info("[DEVELOPMENT] Email del cliente real: %s", customer_email)
+            logger.info("[DEVELOPMENT] Email de prueba: %s", recipient_email)
+        else:
+            recipient_email = customer_email
+            logger.info("[PRODUCTION] Enviando email de confirmación de envío a %s", customer_email)
 
-                recipient_email = self.dev_test_email
-                logger.info(f"[DEVELOPMENT] Enviando email de confirmación de envío del pedido {order_reference}")
-                logger.info(f"[DEVELOPMENT] Email del cliente real: {customer_email}")
-                logger.info(f"[DEVELOPMENT] Email de prueba: {recipient_email}")
-            else:
-                recipient_email = customer_email
-                logger.info(f"[PRODUCTION] Enviando email de confirmación de envío a {customer_email}")
+        # Crear mensaje
+        # EmailMessage + política SMTP: la serialización usa BytesGenerator
+        # internamente y evita la doble conversión str/bytes de as_string()
+        msg = EmailMessage(policy=SMTP_POLICY)
+        msg["From"] = self.sender_email
+        msg["To"] = recipient_email
 
-            # Crear mensaje
-            msg = MIMEMultipart("alternative")
-            msg["From"] = self.sender_email
-            msg["To"] = recipient_email
+        # Agregar BCC solo en producción
+        if self.environment == "production" and self.bcc_email:
+            msg["Bcc"] = self.bcc_email
 
-            # Agregar BCC solo en producción
-            if self.environment == "production" and self.bcc_email:
-                msg["Bcc"] = self.bcc_email
+        msg["Subject"] = f"Confirmación de envío de tu pedido {order_reference}"
 
-            msg["Subject"] = f"Confirmación de envío de tu pedido {order_reference}"
+        # Adjuntar HTML
+        msg.add_alternative(html_content, subtype="html")
+
+        # Destinatarios: el BCC precomputado solo se añade en producción
+        if self.environment == "production":
+            recipients = (recipient_email, *self._prod_bcc_list)
+        else:
+            recipients = (recipient_email,)
 
-            # Adjuntar HTML
-            msg.attach(MIMEText(html_content, "html", "utf-8"))
+        return msg, recipients
 
-            # Enviar email
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls()
-                server.login(self.sender_email, self.sender_password)
+    async def _create_pool_client(self) -> aiosmtplib.SMTP:
+        """Crea y autentica una conexión SMTP asíncrona para el pool."""
+        client = aiosmtplib.SMTP(hostname=self.smtp_server, port=self.smtp_port,
+                                 start_tls=True, timeout=30)
+        await client.connect()
+        await client.login(self.sender_email, self.sender_password)
+        logger.debug("Conexión SMTP del pool establecida con %s", self.smtp_server)
+        return client
 
-                # Preparar lista de destinatarios
-                recipients = [recipient_email]
+    async def _acquire_pool_client(self):
+        """
+        Obtiene una conexión del pool (la crea si es un placeholder).
 
-                # Agregar BCC a la lista de destinatarios solo en producción
-                if self.environment == "production" and self.bcc_email:
-                    recipients.append(self.bcc_email)
+        Returns:
+            Tupla (cliente, mensajes_enviados)
+        """
+        if self._smtp_pool is None:
+            self._smtp_pool = asyncio.Queue()
+            # Placeholders: las conexiones reales se crean bajo demanda
+            for _ in range(self.pool_size):
+                self._smtp_pool.put_nowait((None, 0))
+
+        client, sent_count = await self._smtp_pool.get()
+
+        if client is not None and not client.is_connected:
+            # El servidor cerró la conexión mientras esperaba en el pool
+            logger.debug("Conexión SMTP del pool caducada, se recrea")
+            client = None
+
+        if client is None:
+            try:
+                client = await self._create_pool_client()
+            except Exception:
+                # Devolver el hueco al pool antes de propagar: si no, cada
+                # fallo de conexión encoge el pool y los envíos concurrentes
+                # acaban bloqueados para siempre en queue.get()
+                self._smtp_pool.put_nowait((None, 0))
+                raise
+            sent_count = 0
+
+        return client, sent_count
+
+    async def warm_up_pool(self, expected_messages: Optional[int] = None):
+        """
+        Establece por adelantado las conexiones SMTP del pool.
 
-                server.sendmail(self.sender_email, recipients, msg.as_string())
+        Sin precalentamiento, los primeros envíos concurrentes pagan cada uno
+        el handshake TLS y la autenticación; aquí se abren en paralelo antes
+        de que empiece el procesamiento de pedidos.
 
-            logger.info(f"Email de confirmación de envío enviado correctamente desde {self.sender_email}")
+        Args:
+            expected_messages: Mensajes previstos; si es menor que el tamaño
+                del pool no se abren conexiones de más
+        """
+        if self._smtp_pool is None:
+            self._smtp_pool = asyncio.Queue()
+            for _ in range(self.pool_size):
+                self._smtp_pool.put_nowait((None, 0))
+
+        target = self.pool_size
+        if expected_messages is not None:
+            target = min(target, expected_messages)
+
+        entries = []
+        while not self._smtp_pool.empty():
+            entries.append(self._smtp_pool.get_nowait())
+
+        live = [entry for entry in entries if entry[0] is not None]
+        placeholders = [entry for entry in entries if entry[0] is None]
+        need = min(max(0, target - len(live)), len(placeholders))
+
+        if need:
+            results = await asyncio.gather(
+                *(self._create_pool_client() for _ in range(need)),
+                return_exceptions=True
+            )
+            for result in results:
+                placeholders.pop()
+                if isinstance(result, Exception):
+                    # Los envíos reintentarán la conexión bajo demanda
+                    logger.warning("No se pudo precalentar una conexión SMTP: %s", result)
+                    placeholders.append((None, 0))
+                else:
+                    live.append((result, 0))
+
+        for entry in live + placeholders:
+            self._smtp_pool.put_nowait(entry)
+
+        logger.debug("Pool SMTP precalentado con %s conexiones", len(live))
+
+    async def _release_pool_client(self, client: aiosmtplib.SMTP, sent_count: int):
+        """
+        Devuelve una conexión al pool, reciclándola si superó el límite
+        de mensajes por conexión.
+        """
+        if sent_count >= self.max_messages_per_conn:
+            logger.debug("Reciclando conexión SMTP tras %s mensajes", sent_count)
+            try:
+                await client.quit()
+            except Exception:
+                pass
+            client, sent_count = None, 0
+
+        self._smtp_pool.put_nowait((client, sent_count))
+
+    async def send_shipment_confirmation_email_async(self, customer_email: str,
+                                                     order_reference: str,
+                                                     html_content: str) -> bool:
+        """
+        Versión asíncrona del envío de confirmación usando el pool de conexiones.
+
+        Permite que varios pedidos estén en vuelo simultáneamente sin repetir
+        el handshake SMTP por mensaje.
+
+        Args:
+            customer_email: Email del cliente
+            order_reference: Referencia del pedido
+            html_content: Contenido HTML del email
+
+        Returns:
+            True si se envió correctamente, False en caso contrario
+        """
+        try:
+            msg, recipients = self._build_shipment_message(
+                customer_email, order_reference, html_content)
+            if msg is None:
+                return False
+
+            client, sent_count = await self._acquire_pool_client()
+
+            try:
+                try:
+                    await client.send_message(msg, sender=self.sender_email,
+                                              recipients=recipients)
+                except (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPConnectError) as e:
+                    # El servidor cerró la conexión: reconectar una vez y reintentar
+                    logger.warning("Conexión SMTP del pool perdida (%s), reconectando...", e)
+                    client = await self._create_pool_client()
+                    sent_count = 0
+                    await client.send_message(msg, sender=self.sender_email,
+                                              recipients=recipients)
+
+                sent_count += 1
+            finally:
+                await self._release_pool_client(client, sent_count)
+
+            logger.info("Email de confirmación de envío enviado correctamente desde %s", self.sender_email)
             return True
 
         except Exception as e:
-            logger.error(f"Error al enviar email: {e}")
+            logger.error("Error al enviar email: %s", e)
             return False
+
+    async def close_pool(self):
+        """Cierra todas las conexiones del pool SMTP asíncrono."""
+        if self._smtp_pool is None:
+            return
+
+        while not self._smtp_pool.empty():
+            client, _ = self._smtp_pool.get_nowait()
+            if client is not None:
+                try:
+                    await client.quit()
+                except Exception:
+                    pass
+
+        self._smtp_pool = None
+        logger.debug("Pool de conexiones SMTP cerrado")
+
+    async def aclose(self):
+        """Libera todos los recursos asíncronos (pool SMTP y sesión aiohttp)."""
+        await self.close_pool()
+
+        if self._aio_session is not None and not self._aio_session.closed:
+            await self._aio_session.close()
+            self._aio_session = None
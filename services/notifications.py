@@ -5,11 +5,14 @@ Utilizado para notificar eventos en la confirmación de envíos.
 import asyncio
 import aiohttp
 import aiosmtplib
+import html
+import json
 import os
 import logging
 from datetime import datetime
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+from string import Template
+from email.message import EmailMessage
+from email.policy import SMTP as SMTP_POLICY
 from typing import List, Optional, Dict, Any
 from dotenv import load_dotenv
 
@@ -20,9 +23,65 @@ logger = logging.getLogger("ConfirmationShipmentLogger")
 class NotificationManager:
     """Gestor de notificaciones para email y Slack."""
 
-    def __init__(self):
-        """Inicializar el gestor con configuración desde variables de entorno."""
-        load_dotenv()
+    # Atributos fijos: acceso más rápido que vía __dict__ y menos memoria
+    # por instancia
+    __slots__ = (
+        "email_config", "slack_config", "email_formats",
+        "slack_batch_window", "slack_batch_max",
+        "_notification_emails_tuple", "_notification_emails_header",
+        "_slack_session", "_slack_queue", "_slack_drain_task",
+        "_html_templates", "_plain_templates",
+    )
+
+    # Slack admite como máximo 50 bloques por mensaje
+    SLACK_MAX_BLOCKS_PER_MESSAGE = 48
+
+    # Cabeceras de Slack precompiladas por (type, is_critical): evita
+    # recomputar emoji/estado y reconstruir el bloque en cada notificación
+    _SLACK_HEADER_SKELETONS = {
+        (type_, critical): {
+            "type": "header",
+            "text": {
+                "type": "plain_text",
+                "text": f"{emoji} {status} - Confirmación de Envíos",
+                "emoji": True
+            }
+        }
+        for (type_, critical), (emoji, status) in {
+            ("info", False): ("ℹ️", "INFO"),
+            ("success", False): ("✅", "ÉXITO"),
+            ("warning", False): ("⚠️", "ADVERTENCIA"),
+            ("error", True): ("🚨", "ERROR CRÍTICO"),
+        }.items()
+    }
+
+    # Bloque estático de acción recomendada para notificaciones críticas
+    _SLACK_CRITICAL_ACTION_BLOCK = {
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": "*Acción recomendada:* Intervención inmediata requerida"
+        }
+    }
+
+    def __init__(self, slack_batch_window: float = 1.0, slack_batch_max: int = 50,
+                 email_formats: tuple = ("html", "plain")):
+        """
+        Inicializar el gestor con configuración desde variables de entorno.
+
+        Args:
+            slack_batch_window: Segundos de espera para agrupar notificaciones
+                no críticas en un solo POST al webhook de Slack
+            slack_batch_max: Máximo de notificaciones por lote
+            email_formats: Formatos de cuerpo a generar para los emails
+                ("html", "plain" o ambos); solo se renderizan los indicados
+        """
+        # main.py ya carga el .env al arrancar (y marca _ENV_LOADED); solo
+        # se relee aquí si el gestor se construye de forma aislada, evitando
+        # re-parsear el fichero y pisar variables fijadas por el llamador
+        if not os.getenv("_ENV_LOADED"):
+            load_dotenv()
+            os.environ["_ENV_LOADED"] = "1"
 
         # Configuración de email
         self.email_config = {
@@ -42,9 +101,40 @@ class NotificationManager:
             "username": os.getenv("SLACK_USERNAME", "ConfirmationShipment-Bot")
         }
 
+        # Formatos de cuerpo a renderizar por email
+        self.email_formats = tuple(email_formats)
+
         # Validar configuración
         self._validate_config()
 
+        # Destinatarios precomputados: son inmutables durante la vida del
+        # gestor, no hace falta recalcular el join en cada notificación
+        self._notification_emails_tuple = tuple(self.email_config["notification_emails"])
+        self._notification_emails_header = ", ".join(self._notification_emails_tuple)
+
+        # Sesión aiohttp compartida para el webhook de Slack (se crea de
+        # forma perezosa porque __init__ no es asíncrono)
+        self._slack_session: Optional[aiohttp.ClientSession] = None
+
+        # Cola de notificaciones no críticas para agruparlas en un solo POST.
+        # La tarea de drenado se lanza al encolar el primer elemento.
+        self.slack_batch_window = slack_batch_window
+        self.slack_batch_max = slack_batch_max
+        self._slack_queue: Optional[asyncio.Queue] = None
+        self._slack_drain_task: Optional[asyncio.Task] = None
+
+        # Plantillas de email precompiladas por criticidad: los valores fijos
+        # (color, prefijo, acciones recomendadas) se resuelven una sola vez
+        # aquí en lugar de reevaluar los condicionales en cada notificación
+        self._html_templates = {
+            True: self._build_html_skeleton(is_critical=True),
+            False: self._build_html_skeleton(is_critical=False)
+        }
+        self._plain_templates = {
+            True: self._build_plain_skeleton(is_critical=True),
+            False: self._build_plain_skeleton(is_critical=False)
+        }
+
     def _parse_email_list(self, email_string: str) -> List[str]:
         """Parsea una cadena de emails separados por coma."""
         if not email_string:
@@ -84,25 +174,16 @@ class NotificationManager:
             return False
 
         try:
-            # Crear el mensaje de email
-            email_msg = MIMEMultipart("alternative")
-            email_msg["From"] = self.email_config["sender_email"]
-            email_msg["To"] = ", ".join(
-                self.email_config["notification_emails"])
-
-            # Añadir prefijo según criticidad
-            priority_prefix = "[ERROR CRÍTICO]" if is_critical else "[ADVERTENCIA]"
-            email_msg["Subject"] = f"{priority_prefix} - Confirmación de Envíos: {subject}"
-
-            # Crear contenido HTML y texto plano
-            html_content = self._create_html_email_content(
-                subject, message, error_details, is_critical)
-            plain_content = self._create_plain_email_content(
-                subject, message, error_details, is_critical)
-
-            # Adjuntar ambos formatos
-            email_msg.attach(MIMEText(plain_content, "plain", "utf-8"))
-            email_msg.attach(MIMEText(html_content, "html", "utf-8"))
+            # Construir el mensaje en un hilo aparte: el renderizado de
+            # plantillas y la serialización MIME son trabajo de CPU que no
+            # debe bloquear el event loop (permite que el POST a Slack de una
+            # notificación crítica avance en paralelo)
+            # Timestamp único para todo el despacho (cuerpo HTML y plano)
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+            email_msg = await asyncio.to_thread(
+                self._build_mime, subject, message, error_details, is_critical,
+                timestamp)
 
             # Enviar email usando aiosmtplib
             await aiosmtplib.send(
@@ -115,14 +196,45 @@ class NotificationManager:
                 timeout=30
             )
 
-            logger.info(
-                f"Email notification sent successfully to {len(self.email_config['notification_emails'])} recipients")
+            logger.info("Email notification sent successfully to %s recipients", len(self._notification_emails_tuple))
             return True
 
         except Exception as e:
-            logger.error(f"Failed to send email notification: {e}")
+            logger.error("Failed to send email notification: %s", e)
             return False
 
+    def _build_mime(self, subject: str, message: str, error_details: Optional[Dict[str, Any]], is_critical: bool, timestamp: str) -> EmailMessage:
+        """
+        Construye el mensaje MIME de la notificación (helper síncrono puro).
+
+        Args:
+            subject: Asunto del email
+            message: Mensaje principal
+            error_details: Detalles adicionales del error
+            is_critical: Si es un error crítico
+            timestamp: Fecha/hora ya formateada del despacho
+        """
+        # EmailMessage + política SMTP: serializa vía BytesGenerator sin la
+        # doble conversión str/bytes de la ruta MIMEMultipart.as_string()
+        email_msg = EmailMessage(policy=SMTP_POLICY)
+        email_msg["From"] = self.email_config["sender_email"]
+        email_msg["To"] = self._notification_emails_header
+
+        # Añadir prefijo según criticidad
+        priority_prefix = "[ERROR CRÍTICO]" if is_critical else "[ADVERTENCIA]"
+        email_msg["Subject"] = f"{priority_prefix} - Confirmación de Envíos: {subject}"
+
+        # Renderizar y adjuntar solo los formatos configurados
+        if "plain" in self.email_formats:
+            email_msg.set_content(self._create_plain_email_content(
+                subject, message, error_details, is_critical, timestamp))
+
+        if "html" in self.email_formats:
+            email_msg.add_alternative(self._create_html_email_content(
+                subject, message, error_details, is_critical, timestamp), subtype="html")
+
+        return email_msg
+
     async def send_slack_notification(self, message: str, error_details: Optional[Dict[str, Any]] = None, is_critical: bool = False, type: str = "info"):
         """
         Envía notificación por Slack.
@@ -138,28 +250,145 @@ class NotificationManager:
             return False
 
         try:
-            # Crear el payload para Slack
+            # Crear el payload para Slack (timestamp único del despacho)
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             slack_payload = self._create_slack_payload(
-                message, error_details, is_critical, type=type)
-
-            # Enviar usando aiohttp
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    self.slack_config["webhook_url"],
-                    json=slack_payload,
-                    timeout=aiohttp.ClientTimeout(total=30)
-                ) as response:
-                    if response.status == 200:
-                        logger.info("Slack notification sent successfully")
-                        return True
-                    else:
-                        logger.error(f"Slack API returned status {response.status}: {await response.text()}")
-                        return False
+                message, error_details, is_critical, type=type,
+                timestamp=timestamp)
+
+            if is_critical:
+                # La ruta crítica no se agrupa: enviar de inmediato
+                return await self._post_slack_payload(slack_payload)
+
+            # Notificaciones no críticas: encolar para el envío por lotes
+            await self._enqueue_slack_blocks(slack_payload["blocks"])
+            return True
 
         except Exception as e:
-            logger.error(f"Failed to send Slack notification: {e}")
+            logger.error("Failed to send Slack notification: %s", e)
             return False
 
+    async def _post_slack_payload(self, slack_payload: Dict[str, Any]) -> bool:
+        """Envía un payload al webhook de Slack por la sesión compartida."""
+        try:
+            session = await self._get_slack_session()
+            async with session.post(
+                self.slack_config["webhook_url"],
+                json=slack_payload,
+                timeout=aiohttp.ClientTimeout(total=30)
+            ) as response:
+                if response.status == 200:
+                    logger.info("Slack notification sent successfully")
+                    return True
+                else:
+                    # Leer el cuerpo (lectura de red) solo si se va a registrar
+                    if logger.isEnabledFor(logging.ERROR):
+                        logger.error("Slack API returned status %s: %s",
+                                     response.status, await response.text())
+                    return False
+
+        except Exception as e:
+            logger.error("Failed to send Slack notification: %s", e)
+            return False
+
+    async def _enqueue_slack_blocks(self, blocks: List[Dict[str, Any]]):
+        """
+        Encola los bloques de una notificación no crítica y arranca la tarea
+        de drenado si aún no está corriendo.
+        """
+        if self._slack_queue is None:
+            self._slack_queue = asyncio.Queue()
+
+        await self._slack_queue.put(blocks)
+
+        if self._slack_drain_task is None or self._slack_drain_task.done():
+            self._slack_drain_task = asyncio.create_task(self._drain_slack_queue())
+
+    async def _drain_slack_queue(self):
+        """
+        Tarea de fondo: agrupa hasta slack_batch_max notificaciones (o las
+        llegadas en slack_batch_window segundos) en un solo POST al webhook.
+        """
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self._slack_queue.get()]
+
+            # Esperar la ventana de agrupación para acumular más elementos
+            deadline = loop.time() + self.slack_batch_window
+            while len(batch) < self.slack_batch_max:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(
+                        self._slack_queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._flush_slack_batch(batch)
+
+            for _ in batch:
+                self._slack_queue.task_done()
+
+    async def _flush_slack_batch(self, batch: List[List[Dict[str, Any]]]):
+        """
+        Envía un lote de notificaciones como uno o más mensajes, separando
+        cada notificación con un divisor y respetando el límite de bloques
+        por mensaje de Slack.
+        """
+        combined: List[Dict[str, Any]] = []
+
+        for blocks in batch:
+            if combined and len(combined) + 1 + len(blocks) > self.SLACK_MAX_BLOCKS_PER_MESSAGE:
+                await self._post_slack_payload(self._batch_payload(combined))
+                combined = []
+
+            if combined:
+                combined.append({"type": "divider"})
+            combined.extend(blocks)
+
+        if combined:
+            await self._post_slack_payload(self._batch_payload(combined))
+
+    def _batch_payload(self, blocks: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Construye el payload del webhook para un lote de bloques."""
+        payload = {
+            "username": self.slack_config["username"],
+            "blocks": blocks
+        }
+
+        if self.slack_config["channel"] and self.slack_config["channel"] != "#general":
+            payload["channel"] = self.slack_config["channel"]
+
+        return payload
+
+    async def _get_slack_session(self) -> aiohttp.ClientSession:
+        """Devuelve la sesión aiohttp para Slack, creándola si es necesario."""
+        if self._slack_session is None or self._slack_session.closed:
+            self._slack_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=10, ttl_dns_cache=300, keepalive_timeout=60)
+            )
+        return self._slack_session
+
+    async def close(self):
+        """Vacía la cola de lotes pendientes y cierra la sesión de Slack."""
+        if self._slack_drain_task is not None and not self._slack_drain_task.done():
+            # Esperar a que se envíen las notificaciones encoladas
+            await self._slack_queue.join()
+            self._slack_drain_task.cancel()
+            try:
+                await self._slack_drain_task
+            except asyncio.CancelledError:
+                pass
+            self._slack_drain_task = None
+
+        if self._slack_session is not None and not self._slack_session.closed:
+            await self._slack_session.close()
+            self._slack_session = None
+            logger.debug("Sesión de Slack cerrada")
+
     async def send_critical_notification(self, title: str, message: str, error_details: Optional[Dict[str, Any]] = None):
         """
         Envía notificación crítica por todos los canales disponibles.
@@ -169,7 +398,7 @@ class NotificationManager:
             message: Mensaje descriptivo del problema
             error_details: Detalles técnicos del error
         """
-        logger.info(f"Sending critical notification: {title}")
+        logger.info("Sending critical notification: %s", title)
 
         # Enviar por ambos canales simultáneamente
         email_task = self.send_email_notification(
@@ -182,11 +411,11 @@ class NotificationManager:
 
         # Log results
         if isinstance(email_result, Exception):
-            logger.error(f"Email notification failed: {email_result}")
+            logger.error("Email notification failed: %s", email_result)
             email_result = False
 
         if isinstance(slack_result, Exception):
-            logger.error(f"Slack notification failed: {slack_result}")
+            logger.error("Slack notification failed: %s", slack_result)
             slack_result = False
 
         success = email_result or slack_result
@@ -207,7 +436,7 @@ class NotificationManager:
             message: Mensaje informativo
             type: Tipo de notificación (info, success)
         """
-        logger.info(f"Sending info notification: {title}")
+        logger.info("Sending info notification: %s", title)
 
         # Para notificaciones informativas, preferimos Slack
         slack_result = await self.send_slack_notification(f"{title}: {message}", is_critical=False, type=type)
@@ -219,13 +448,16 @@ class NotificationManager:
 
         return slack_result
 
-    def _create_html_email_content(self, subject: str, message: str, error_details: Optional[Dict[str, Any]], is_critical: bool) -> str:
-        """Crea contenido HTML para el email."""
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    def _build_html_skeleton(self, is_critical: bool) -> Template:
+        """
+        Construye la plantilla HTML con los valores fijos de la criticidad
+        ya resueltos. Solo quedan como variables: subject, message,
+        timestamp y details.
+        """
         # Rojo para crítico, amarillo para advertencia
         color = "#dc3545" if is_critical else "#ffc107"
 
-        html = f"""
+        return Template(f"""
         <!DOCTYPE html>
         <html>
         <head>
@@ -245,11 +477,11 @@ class NotificationManager:
                 <h2>{'🚨 Error' if is_critical else '⚠️ Advertencia'} - Confirmación de Envíos</h2>
             </div>
             <div class="content">
-                <p><strong>Problema detectado:</strong> {subject}</p>
-                <p><strong>Descripción:</strong> {message}</p>
-                <p class="timestamp"><strong>Fecha y hora:</strong> {timestamp}</p>
+                <p><strong>Problema detectado:</strong> $subject</p>
+                <p><strong>Descripción:</strong> $message</p>
+                <p class="timestamp"><strong>Fecha y hora:</strong> $timestamp</p>
 
-                {self._format_error_details_html(error_details) if error_details else ""}
+                $details
 
                 <div style="margin-top: 20px; padding: 15px; background-color: {'#f8d7da' if is_critical else '#fff3cd'}; border-radius: 5px;">
                     <strong>{'Acción requerida:' if is_critical else 'Recomendación:'}</strong>
@@ -265,22 +497,22 @@ class NotificationManager:
             </div>
         </body>
         </html>
-        """
-        return html
+        """)
 
-    def _create_plain_email_content(self, subject: str, message: str, error_details: Optional[Dict[str, Any]], is_critical: bool) -> str:
-        """Crea contenido de texto plano para el email."""
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    def _build_plain_skeleton(self, is_critical: bool) -> Template:
+        """
+        Construye la plantilla de texto plano con los valores fijos de la
+        criticidad ya resueltos.
+        """
         priority = "CRÍTICO" if is_critical else "ADVERTENCIA"
 
-        content = f"""
-{priority} - Confirmación de Envíos
+        return Template(f"""{priority} - Confirmación de Envíos
 
-Problema detectado: {subject}
-Descripción: {message}
-Fecha y hora: {timestamp}
+Problema detectado: $subject
+Descripción: $message
+Fecha y hora: $timestamp
 
-{self._format_error_details_plain(error_details) if error_details else ""}
+$details
 
 {'Acción requerida:' if is_critical else 'Recomendación:'}
 - Revisar los logs del sistema
@@ -288,27 +520,41 @@ Fecha y hora: {timestamp}
 - Contactar al equipo técnico si el problema persiste
 
 ---
-Confirmación de Envíos - Sistema Automatizado - Generado automáticamente
-        """
-        return content.strip()
+Confirmación de Envíos - Sistema Automatizado - Generado automáticamente""")
 
-    def _create_slack_payload(self, message: str, error_details: Optional[Dict[str, Any]], is_critical: bool, type: str = "info") -> Dict[str, Any]:
+    def _create_html_email_content(self, subject: str, message: str, error_details: Optional[Dict[str, Any]], is_critical: bool, timestamp: str) -> str:
+        """Crea contenido HTML para el email."""
+        # Escapar los valores externos una sola vez antes de interpolarlos
+        return self._html_templates[is_critical].substitute(
+            subject=html.escape(str(subject)),
+            message=html.escape(str(message)),
+            timestamp=timestamp,
+            details=self._format_error_details_html(error_details) if error_details else ""
+        )
+
+    def _create_plain_email_content(self, subject: str, message: str, error_details: Optional[Dict[str, Any]], is_critical: bool, timestamp: str) -> str:
+        """Crea contenido de texto plano para el email."""
+        return self._plain_templates[is_critical].substitute(
+            subject=subject,
+            message=message,
+            timestamp=timestamp,
+            details=self._format_error_details_plain(error_details) if error_details else ""
+        )
+
+    def _create_slack_payload(self, message: str, error_details: Optional[Dict[str, Any]], is_critical: bool, type: str = "info", timestamp: Optional[str] = None) -> Dict[str, Any]:
         """Crea el payload para Slack webhook usando el formato moderno de blocks."""
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if timestamp is None:
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        # Emoji y color según criticidad
-        emoji = "ℹ️" if type == "info" else "✅" if type == "success" else "🚨" if is_critical else "⚠️"
-        status_text = "INFO" if type == "info" else "ÉXITO" if type == "success" else "ERROR CRÍTICO" if is_critical else "ADVERTENCIA"
+        # Cabecera precompilada según (type, is_critical); las combinaciones
+        # no previstas caen en la variante crítica o de advertencia
+        header = self._SLACK_HEADER_SKELETONS.get((type, is_critical))
+        if header is None:
+            header = self._SLACK_HEADER_SKELETONS[
+                ("error", True) if is_critical else ("warning", False)]
 
         blocks = [
-            {
-                "type": "header",
-                "text": {
-                    "type": "plain_text",
-                    "text": f"{emoji} {status_text} - Confirmación de Envíos",
-                    "emoji": True
-                }
-            },
+            header,
             {
                 "type": "section",
                 "text": {
@@ -335,14 +581,7 @@ Confirmación de Envíos - Sistema Automatizado - Generado automáticamente
 
         # Añadir acciones recomendadas
         if is_critical:
-            action_text = "Intervención inmediata requerida"
-            blocks.append({
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": f"*Acción recomendada:* {action_text}"
-                }
-            })
+            blocks.append(self._SLACK_CRITICAL_ACTION_BLOCK)
 
         # Añadir contexto en el footer
         blocks.append({
@@ -368,18 +607,25 @@ Confirmación de Envíos - Sistema Automatizado - Generado automáticamente
         return payload
 
     def _format_error_details_html(self, error_details: Dict[str, Any]) -> str:
-        """Formatea detalles del error para HTML."""
-        html = '<div class="details"><h4>Detalles técnicos:</h4>'
+        """
+        Formatea detalles del error para HTML.
+
+        Los valores se escapan siempre (los detalles pueden incluir datos
+        del cliente o mensajes de error externos) y las estructuras se
+        serializan con JSON acotado a 4 KB para evitar cuerpos desmesurados.
+        """
+        content = '<div class="details"><h4>Detalles técnicos:</h4>'
 
         for key, value in error_details.items():
-            html += f'<p><strong>{key.replace("_", " ").title()}:</strong></p>'
+            content += f'<p><strong>{html.escape(key.replace("_", " ").title())}:</strong></p>'
             if isinstance(value, (dict, list)):
-                html += f'<pre>{str(value)}</pre>'
+                serialized = json.dumps(value, ensure_ascii=False, default=str)[:4096]
+                content += f'<pre>{html.escape(serialized)}</pre>'
             else:
-                html += f'<p style="margin-left: 20px;">{value}</p>'
+                content += f'<p style="margin-left: 20px;">{html.escape(str(value))}</p>'
 
-        html += '</div>'
-        return html
+        content += '</div>'
+        return content
 
     def _format_error_details_plain(self, error_details: Dict[str, Any]) -> str:
         """Formatea detalles del error para texto plano."""
@@ -391,11 +637,18 @@ Confirmación de Envíos - Sistema Automatizado - Generado automáticamente
         return details
 
     def _format_error_details_slack(self, error_details: Dict[str, Any]) -> str:
-        """Formatea detalles del error para Slack."""
+        """
+        Formatea detalles del error para Slack.
+
+        Cada valor se acota a 512 caracteres para que el truncado final del
+        payload no tenga que recorrer textos enormes.
+        """
         details = []
 
         for key, value in error_details.items():
-            details.append(f"{key.replace('_', ' ').title()}: {value}")
+            if isinstance(value, (dict, list)):
+                value = json.dumps(value, ensure_ascii=False, default=str)
+            details.append(f"{key.replace('_', ' ').title()}: {str(value)[:512]}")
 
         return "\n".join(details)
 
@@ -405,9 +658,13 @@ Confirmación de Envíos - Sistema Automatizado - Generado automáticamente
 
     async def notify_warning(self, title: str, message: str, error_details: Optional[Dict[str, Any]] = None):
         """Función de conveniencia para notificar advertencias."""
-        email_result = await self.send_email_notification(title, message, error_details, is_critical=False)
-        slack_result = await self.send_slack_notification(f"{title}: {message}", error_details, is_critical=False, type="warning")
-        return email_result or slack_result
+        # Ambos canales en paralelo: el envío por email no bloquea el de Slack
+        email_result, slack_result = await asyncio.gather(
+            self.send_email_notification(title, message, error_details, is_critical=False),
+            self.send_slack_notification(f"{title}: {message}", error_details, is_critical=False, type="warning"),
+            return_exceptions=True
+        )
+        return email_result is True or slack_result is True
 
     async def notify_info(self, title: str, message: str):
         """Función de conveniencia para notificar información."""
@@ -419,16 +676,34 @@ Confirmación de Envíos - Sistema Automatizado - Generado automáticamente
 
 
 def run_notification_sync(coro):
-    """Helper para ejecutar notificaciones desde código síncrono."""
+    """
+    Helper para ejecutar notificaciones desde código síncrono.
+
+    Si ya hay un event loop corriendo en este hilo, programa la corrutina
+    como tarea y la devuelve: el llamador DEBE esperarla (await) o la
+    notificación puede perderse al cerrar el loop. Si no hay loop, la
+    ejecuta de forma bloqueante con asyncio.run.
+    """
     try:
-        loop = asyncio.get_event_loop()
-        if loop.is_running():
-            # Si ya hay un loop corriendo, crear una tarea
-            task = asyncio.create_task(coro)
-            return task
-        else:
-            # Si no hay loop, usar run
-            return loop.run_until_complete(coro)
+        loop = asyncio.get_running_loop()
     except RuntimeError:
-        # Si no hay loop, crear uno nuevo
+        # No hay loop en este hilo: ejecutar de forma bloqueante
         return asyncio.run(coro)
+
+    logger.debug(
+        "run_notification_sync llamado con un loop activo; la tarea devuelta debe esperarse")
+    return asyncio.ensure_future(coro, loop=loop)
+
+
+def run_notification_threadsafe(coro, loop, timeout: float = 30):
+    """
+    Ejecuta una notificación en el loop indicado desde OTRO hilo y espera
+    el resultado de forma bloqueante.
+
+    Args:
+        coro: Corrutina de notificación a ejecutar
+        loop: Event loop (corriendo en otro hilo) donde ejecutarla
+        timeout: Segundos máximos de espera por el resultado
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, loop)
+    return future.result(timeout=timeout)
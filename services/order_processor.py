@@ -3,9 +3,12 @@ Procesador de pedidos para confirmación de envíos.
 Orquesta el flujo completo de procesamiento de pedidos con número de seguimiento.
 """
 
+import asyncio
 import logging
+import msgspec
+from collections import deque
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 
 from .prestashop_service import PrestaShopService
 from .email_service import EmailService
@@ -14,12 +17,26 @@ from .notifications import NotificationManager
 logger = logging.getLogger("ConfirmationShipmentLogger")
 
 
+class ErrorDetails(msgspec.Struct):
+    """Detalle de errores del resumen de ejecución (struct sin __dict__)."""
+    total_orders: int
+    successful: int
+    failed: int
+    errors: List[Dict[str, Any]]
+
+
+def _xlink(field: Any, _get=dict.get) -> Optional[str]:
+    """Extrae el @xlink:href de un campo de recurso (o None)."""
+    return _get(field, "@xlink:href") if type(field) is dict else None
+
+
 class OrderProcessor:
     """Procesador de pedidos de confirmación de envíos."""
 
     def __init__(self, prestashop_service: PrestaShopService,
                  email_service: EmailService,
-                 notification_manager: NotificationManager):
+                 notification_manager: NotificationManager,
+                 concurrency: int = 10):
         """
         Inicializa el procesador de pedidos.
 
@@ -27,25 +44,37 @@ class OrderProcessor:
             prestashop_service: Servicio de PrestaShop
             email_service: Servicio de email
             notification_manager: Gestor de notificaciones
+            concurrency: Pedidos procesados en paralelo como máximo (el envío
+                de emails queda además acotado por el pool SMTP)
         """
         self.prestashop_service = prestashop_service
         self.email_service = email_service
         self.notification_manager = notification_manager
+        self.concurrency = concurrency
 
-        # Estadísticas de la ejecución
+        # Actualizaciones de estado despachadas en segundo plano, pendientes
+        # de recoger al final de la ejecución
+        self._pending_state_updates = []
+
+        # Estadísticas de la ejecución. El resumen solo reporta los últimos
+        # 5 errores, así que el deque acotado evita acumular sin límite
         self.stats = {
             "orders_processed": 0,
             "orders_success": 0,
             "orders_failed": 0,
-            "errors": []
+            "errors": deque(maxlen=5)
         }
 
-    def process_single_order(self, order: Dict[str, Any]) -> bool:
+    async def process_single_order(self, order: Dict[str, Any],
+                                   customers_map: Optional[Dict[str, Dict[str, Any]]] = None,
+                                   addresses_map: Optional[Dict[str, Dict[str, Any]]] = None) -> bool:
         """
         Procesa un único pedido: obtiene datos, genera email, envía y actualiza estado.
 
         Args:
             order: Datos del pedido
+            customers_map: Clientes precargados en bloque (id -> datos)
+            addresses_map: Direcciones precargadas en bloque (id -> datos)
 
         Returns:
             True si se procesó correctamente, False en caso contrario
@@ -55,76 +84,140 @@ class OrderProcessor:
             order_reference = order.get("reference")
             tracking_number = order.get("shipping_number", {}).get("_", "")
 
-            logger.info(f"Procesando pedido {order_reference} (ID: {order_id}) - Seguimiento: {tracking_number}")
+            logger.info("Procesando pedido %s (ID: %s) - Seguimiento: %s", order_reference, order_id, tracking_number)
 
-            # Obtener URLs de recursos relacionados
-            customer_url = self._extract_xlink_href(order.get("id_customer"))
-            address_url = self._extract_xlink_href(order.get("id_address_delivery"))
+            # Resolver cliente y dirección desde la precarga masiva; si algún
+            # recurso no vino en el bloque, fallback al fetch individual
+            customer = (customers_map or {}).get(
+                self._extract_resource_id(order.get("id_customer")))
+            address = (addresses_map or {}).get(
+                self._extract_resource_id(order.get("id_address_delivery")))
 
-            if not customer_url or not address_url:
-                logger.error(f"Pedido {order_id} no tiene URLs de cliente o dirección")
-                return False
+            if customer is None or address is None:
+                customer, address = await self._fetch_missing_resources(
+                    order, customer, address)
 
-            # Obtener datos del cliente
-            customer = self.prestashop_service.fetch_customer_data(customer_url)
             if not customer:
-                logger.error(f"No se pudo obtener datos del cliente para pedido {order_id}")
+                logger.error("No se pudo obtener datos del cliente para pedido %s", order_id)
                 return False
 
-            # Obtener datos de la dirección
-            address = self.prestashop_service.fetch_address_data(address_url)
             if not address:
-                logger.error(f"No se pudo obtener dirección para pedido {order_id}")
+                logger.error("No se pudo obtener dirección para pedido %s", order_id)
                 return False
 
-            # Generar plantilla de email
-            html_content = self.email_service.generate_email_template(order, customer, address)
+            # Generar plantilla de email (asíncrono: varios pedidos pueden
+            # renderizar su plantilla en paralelo)
+            html_content = await self.email_service.generate_email_template_async(
+                order, customer, address)
             if not html_content:
-                logger.error(f"No se pudo generar plantilla para pedido {order_id}")
+                logger.error("No se pudo generar plantilla para pedido %s", order_id)
                 return False
 
-            # Enviar email de confirmación de envío
-            email_sent = self.email_service.send_shipment_confirmation_email(
+            # Enviar email de confirmación de envío (pool de conexiones SMTP)
+            email_sent = await self.email_service.send_shipment_confirmation_email_async(
                 customer["email"],
                 order_reference,
                 html_content
             )
 
             if not email_sent:
-                logger.error(f"No se pudo enviar email para pedido {order_id}")
+                logger.error("No se pudo enviar email para pedido %s", order_id)
                 return False
 
-            # Actualizar estado del pedido a 4 (Enviado)
-            state_updated = self.prestashop_service.update_order_state(order_id, new_state=4)
+            # Despachar la actualización de estado a 4 (Enviado) sin bloquear
+            # el pipeline del pedido: las tareas se recogen al final de la
+            # ejecución. Un fallo aquí es éxito parcial (el email ya se envió)
+            self._pending_state_updates.append((
+                order_id,
+                asyncio.create_task(
+                    self.prestashop_service.update_order_state(order_id, new_state=4))
+            ))
 
-            if not state_updated:
-                logger.warning(f"Email enviado pero no se pudo actualizar estado del pedido {order_id}")
-                # Consideramos éxito parcial, ya que el email se envió
-
-            logger.info(f"Pedido {order_reference} procesado correctamente")
+            logger.info("Pedido %s procesado correctamente", order_reference)
             return True
 
         except Exception as e:
-            logger.error(f"Error al procesar pedido: {e}")
+            logger.error("Error al procesar pedido: %s", e)
             self.stats["errors"].append({
                 "order_id": order.get("id"),
                 "error": str(e)
             })
             return False
 
-    def _extract_xlink_href(self, field: Any) -> str:
+    def _extract_resource_id(self, field: Any) -> Optional[str]:
         """
-        Extrae la URL de un campo con xlink:href.
+        Extrae el ID de un campo de recurso relacionado.
 
         Args:
-            field: Campo que puede contener @xlink:href
+            field: Campo que puede contener el ID como texto o como dict
 
         Returns:
-            URL extraída o None
+            ID como cadena o None
         """
         if isinstance(field, dict):
-            return field.get("@xlink:href")
-        return None
+            field = field.get("_")
+        return str(field) if field else None
+
+    async def _fetch_missing_resources(self, order: Dict[str, Any],
+                                       customer: Optional[Dict[str, Any]],
+                                       address: Optional[Dict[str, Any]]) -> tuple:
+        """
+        Obtiene individualmente el cliente y/o la dirección que no vinieron
+        en la precarga masiva.
+
+        Args:
+            order: Datos del pedido
+            customer: Cliente ya resuelto (o None)
+            address: Dirección ya resuelta (o None)
+
+        Returns:
+            Tupla (customer, address) con los recursos resueltos
+        """
+        tasks = []
+
+        if customer is None:
+            customer_url = _xlink(order.get("id_customer"))
+            if customer_url:
+                tasks.append(("customer", self.prestashop_service.fetch_customer_data(customer_url)))
+
+        if address is None:
+            address_url = _xlink(order.get("id_address_delivery"))
+            if address_url:
+                tasks.append(("address", self.prestashop_service.fetch_address_data(address_url)))
+
+        if tasks:
+            results = await asyncio.gather(*(coro for _, coro in tasks))
+            for (name, _), result in zip(tasks, results):
+                if name == "customer":
+                    customer = result
+                else:
+                    address = result
+
+        return customer, address
+
+    async def _bounded_process(self, semaphore: asyncio.Semaphore,
+                               order: Dict[str, Any],
+                               customers_map: Dict[str, Dict[str, Any]],
+                               addresses_map: Dict[str, Dict[str, Any]]) -> bool:
+        """Procesa un pedido respetando el límite de concurrencia."""
+        async with semaphore:
+            return await self.process_single_order(order, customers_map, addresses_map)
+
+    async def _drain_state_updates(self):
+        """Espera las actualizaciones de estado despachadas en segundo plano."""
+        if not self._pending_state_updates:
+            return
+
+        results = await asyncio.gather(
+            *(task for _, task in self._pending_state_updates),
+            return_exceptions=True
+        )
+
+        for (order_id, _), result in zip(self._pending_state_updates, results):
+            if result is not True:
+                logger.warning("Email enviado pero no se pudo actualizar estado del pedido %s", order_id)
+
+        self._pending_state_updates.clear()
 
     async def send_execution_summary(self):
         """Envía un resumen de la ejecución vía notificaciones."""
@@ -145,17 +238,17 @@ Procesamiento de envíos completado:
 
             if self.stats["orders_failed"] > 0:
                 # Hay errores, enviar como advertencia
-                error_details = {
-                    "total_orders": self.stats["orders_processed"],
-                    "successful": self.stats["orders_success"],
-                    "failed": self.stats["orders_failed"],
-                    "errors": self.stats["errors"][:5]  # Primeros 5 errores
-                }
+                error_details = ErrorDetails(
+                    total_orders=self.stats["orders_processed"],
+                    successful=self.stats["orders_success"],
+                    failed=self.stats["orders_failed"],
+                    errors=list(self.stats["errors"])  # Últimos 5 errores
+                )
 
                 await self.notification_manager.notify_warning(
                     "Ejecución de envíos completada con errores",
                     message,
-                    error_details
+                    msgspec.to_builtins(error_details)
                 )
             else:
                 # Todo OK, enviar como éxito
@@ -165,7 +258,7 @@ Procesamiento de envíos completado:
                 )
 
         except Exception as e:
-            logger.error(f"Error al enviar resumen de ejecución: {e}")
+            logger.error("Error al enviar resumen de ejecución: %s", e)
 
     async def process_all_orders_async(self):
         """Procesa todos los pedidos pendientes de envío de forma asíncrona."""
@@ -174,8 +267,11 @@ Procesamiento de envíos completado:
             logger.info("Iniciando proceso de confirmación de envíos")
             logger.info("=" * 80)
 
+            # Empezar la ejecución con la memoización de recursos limpia
+            self.prestashop_service.reset_run_cache()
+
             # Consultar pedidos pendientes de envío (estado 3 con número de seguimiento)
-            orders = self.prestashop_service.fetch_pending_shipment_orders()
+            orders = await self.prestashop_service.fetch_pending_shipment_orders()
 
             if orders is None:
                 logger.error("Error al consultar pedidos")
@@ -190,30 +286,60 @@ Procesamiento de envíos completado:
                 logger.info("No hay pedidos pendientes de envío para procesar")
                 return
 
-            # Procesar cada pedido
-            for order in orders:
-                self.stats["orders_processed"] += 1
+            # Precargar clientes y direcciones en bloque: dos peticiones en
+            # total en lugar de dos por pedido (fallback individual si algún
+            # recurso no viene en la respuesta masiva)
+            customer_ids = sorted({cid for order in orders
+                                   if (cid := self._extract_resource_id(order.get("id_customer")))})
+            address_ids = sorted({aid for order in orders
+                                  if (aid := self._extract_resource_id(order.get("id_address_delivery")))})
+
+            customers_map, addresses_map = await asyncio.gather(
+                self.prestashop_service.fetch_customers_bulk(customer_ids),
+                self.prestashop_service.fetch_addresses_bulk(address_ids)
+            )
 
-                success = self.process_single_order(order)
+            # Abrir por adelantado las conexiones SMTP que usará el fan-out
+            await self.email_service.warm_up_pool(len(orders))
 
+            # Procesar los pedidos de forma concurrente con el paralelismo
+            # acotado (el pool SMTP impone además su propio límite de envíos)
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            results = await asyncio.gather(
+                *(self._bounded_process(semaphore, order, customers_map, addresses_map)
+                  for order in orders)
+            )
+
+            for success in results:
+                self.stats["orders_processed"] += 1
                 if success:
                     self.stats["orders_success"] += 1
                 else:
                     self.stats["orders_failed"] += 1
 
+            # Recoger las actualizaciones de estado pendientes
+            await self._drain_state_updates()
+
             # Enviar resumen
             await self.send_execution_summary()
 
             logger.info("=" * 80)
-            logger.info(f"Proceso completado - Procesados: {self.stats['orders_processed']}, "
-                       f"Exitosos: {self.stats['orders_success']}, "
-                       f"Fallidos: {self.stats['orders_failed']}")
+            logger.info("Proceso completado - Procesados: %s, Exitosos: %s, Fallidos: %s",
+                        self.stats["orders_processed"],
+                        self.stats["orders_success"],
+                        self.stats["orders_failed"])
             logger.info("=" * 80)
 
         except Exception as e:
-            logger.error(f"Error crítico en el proceso principal: {e}", exc_info=True)
+            logger.error("Error crítico en el proceso principal: %s", e, exc_info=True)
             await self.notification_manager.notify_critical_error(
                 "Error crítico en proceso de confirmación de envíos",
                 str(e),
                 {"timestamp": datetime.now().isoformat(), "traceback": str(e)}
             )
+        finally:
+            # Liberar los recursos asíncronos (pool SMTP y sesión aiohttp)
+            # y las conexiones keep-alive hacia PrestaShop
+            await self.email_service.aclose()
+            await self.prestashop_service.aclose()
@@ -4,18 +4,46 @@ Maneja consultas de pedidos, clientes, direcciones y actualización de estados.
 Específico para confirmación de envíos (estado 3).
 """
 
+import asyncio
 import logging
-import requests
-import xmltodict
+import time
+import httpx
+from lxml import etree
+from string import Template
 from typing import Dict, List, Any, Optional
-from requests.auth import HTTPBasicAuth
 
 logger = logging.getLogger("ConfirmationShipmentLogger")
 
+# Nombre calificado del atributo xlink:href en los nodos de recurso
+_XLINK_HREF = "{http://www.w3.org/1999/xlink}href"
+
+# Esqueleto del payload de order_history, precompilado una sola vez:
+# en cada actualización solo se sustituyen el pedido y el estado
+_ORDER_HISTORY_TEMPLATE = Template("""<?xml version="1.0" encoding="UTF-8"?>
+<prestashop xmlns:xlink="http://www.w3.org/1999/xlink">
+    <order_history>
+        <id_order>${order_id}</id_order>
+        <id_employee>5</id_employee>
+        <id_order_state>${new_state}</id_order_state>
+    </order_history>
+</prestashop>""")
+
 
 class PrestaShopService:
     """Servicio para interactuar con PrestaShop API."""
 
+    # Apertura máxima del circuito tras fallos consecutivos (segundos)
+    BREAKER_MAX_OPEN = 60
+
+    # Pedidos por página del listado: acota el tamaño de cada respuesta
+    ORDERS_PAGE_SIZE = 200
+
+    # Reintento corto ante errores 5xx y 429 (los reintentos de transporte
+    # de httpx solo cubren fallos de conexión, no respuestas de error)
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+    RETRY_ATTEMPTS = 2
+    RETRY_WAIT = 1.0
+
     def __init__(self, api_url: str, username: str, password: str):
         """
         Inicializa el servicio de PrestaShop.
@@ -26,9 +54,117 @@ class PrestaShopService:
             password: Contraseña para autenticación
         """
         self.api_url = api_url
-        self.auth = HTTPBasicAuth(username, password)
 
-    def fetch_pending_shipment_orders(self) -> Optional[List[Dict[str, Any]]]:
+        # Cliente asíncrono con pool de conexiones keep-alive: permite que
+        # varios pedidos consulten la API en paralelo reutilizando sockets
+        # TLS ya establecidos
+        self.session = httpx.AsyncClient(
+            auth=(username, password),
+            timeout=30.0,
+            # Negociar HTTP/2 si el servidor lo soporta: multiplexa las
+            # consultas concurrentes sobre una sola conexión TLS. Si no,
+            # httpx sigue con HTTP/1.1 sin cambio de comportamiento
+            http2=True,
+            # Pedir las respuestas XML comprimidas: el listado de pedidos
+            # con display=full comprime muy bien
+            headers={"Accept-Encoding": "gzip, deflate"},
+            limits=httpx.Limits(max_connections=100,
+                                max_keepalive_connections=20)
+        )
+
+        # URL y cabeceras de actualización de estado, calculadas una sola vez
+        self._order_history_url = f"{self.api_url}/order_histories"
+        self._xml_headers = {"Content-Type": "application/xml"}
+
+        # Endpoint y parámetros base del listado de pedidos; el límite de
+        # página se sustituye en cada iteración de la paginación
+        self._orders_endpoint = f"{self.api_url}/orders"
+        self._orders_params_base = {
+            "filter[payment]": "[PayPal|Redsys|PayPal with fee|Pagos por transferencia bancaria]",
+            "filter[current_state]": "[3]",
+            "display": "full",
+            "limit": f"0,{self.ORDERS_PAGE_SIZE}"
+        }
+
+        # Memoización por ejecución de los fetch individuales, por URL de
+        # recurso: varios pedidos del mismo cliente comparten resultado
+        self._resource_cache: Dict[str, Dict[str, Any]] = {}
+
+        # Registrar una sola vez la versión HTTP negociada
+        self._http_version_logged = False
+
+        # Circuit breaker: tras fallos consecutivos el circuito se abre y
+        # las llamadas se omiten hasta que pase la ventana de apertura
+        self._breaker = {"consecutive_failures": 0, "open_until": 0.0}
+
+    def _breaker_allows(self) -> bool:
+        """Comprueba si el circuito permite llamar a la API."""
+        if time.time() < self._breaker["open_until"]:
+            logger.warning("Circuito abierto hacia PrestaShop, se omite la llamada")
+            return False
+        return True
+
+    def _breaker_record_success(self):
+        """Cierra el circuito tras una llamada exitosa."""
+        self._breaker["consecutive_failures"] = 0
+        self._breaker["open_until"] = 0.0
+
+    def _breaker_record_failure(self):
+        """Registra un fallo y abre el circuito con backoff exponencial."""
+        self._breaker["consecutive_failures"] += 1
+        open_for = min(self.BREAKER_MAX_OPEN,
+                       2 ** self._breaker["consecutive_failures"])
+        self._breaker["open_until"] = time.time() + open_for
+        logger.warning("Fallo %s consecutivo hacia PrestaShop, circuito abierto %ss",
+                       self._breaker["consecutive_failures"], open_for)
+
+    async def _request_with_retry(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Emite una petición con reintento corto ante respuestas 5xx y
+        actualiza el estado del circuit breaker.
+
+        Args:
+            method: Método HTTP
+            url: URL de la petición
+            **kwargs: Argumentos adicionales para el cliente
+
+        Returns:
+            Respuesta exitosa
+
+        Raises:
+            httpx.HTTPError: Si la petición sigue fallando tras los reintentos
+        """
+        attempt = 0
+
+        while True:
+            try:
+                response = await self.session.request(method, url, **kwargs)
+
+                if (response.status_code in self.RETRY_STATUS
+                        and attempt < self.RETRY_ATTEMPTS):
+                    attempt += 1
+                    logger.warning("Respuesta %s de %s, reintento %s/%s",
+                                   response.status_code, url, attempt, self.RETRY_ATTEMPTS)
+                    await asyncio.sleep(self.RETRY_WAIT * attempt)
+                    continue
+
+                response.raise_for_status()
+                self._breaker_record_success()
+                return response
+
+            except httpx.HTTPError:
+                self._breaker_record_failure()
+                raise
+
+    def reset_run_cache(self):
+        """Vacía la memoización de recursos al inicio de cada ejecución."""
+        self._resource_cache.clear()
+
+    async def aclose(self):
+        """Cierra el cliente HTTP y sus conexiones."""
+        await self.session.aclose()
+
+    async def fetch_pending_shipment_orders(self) -> Optional[List[Dict[str, Any]]]:
         """
         Consulta la API de PrestaShop para obtener pedidos pendientes de envío.
 
@@ -39,151 +175,262 @@ class PrestaShopService:
         Returns:
             Lista de pedidos o None si hay error
         """
+        if not self._breaker_allows():
+            return None
+
         try:
-            url = f"{self.api_url}/orders"
-            params = {
-                "filter[payment]": "[PayPal|Redsys|PayPal with fee|Pagos por transferencia bancaria]",
-                "filter[current_state]": "[3]",
-                "display": "full"
-            }
+            logger.info("Consultando pedidos pendientes de envío: %s", self._orders_endpoint)
+
+            orders_with_tracking = []
+            total_orders = 0
+            offset = 0
+
+            # Paginar el listado: cada página se descarga y parsea en
+            # streaming (los pedidos se extraen según llegan los bytes y en
+            # la misma pasada se descartan los que no tienen seguimiento).
+            # Una página incompleta indica que no quedan más pedidos
+            while True:
+                params = self._orders_params_base | {
+                    "limit": f"{offset},{self.ORDERS_PAGE_SIZE}"
+                }
+
+                try:
+                    page_orders, page_total = await self._stream_orders_page(
+                        self._orders_endpoint, params)
+                except etree.XMLSyntaxError as parse_error:
+                    logger.error("Error al parsear XML: %s", parse_error)
+                    return None
+
+                orders_with_tracking.extend(page_orders)
+                total_orders += page_total
+
+                if page_total < self.ORDERS_PAGE_SIZE:
+                    break
+
+                offset += self.ORDERS_PAGE_SIZE
+                logger.debug("Página completa de pedidos, continuando desde %s", offset)
+
+            logger.info("Se encontraron %s pedidos en estado 3, %s con número de seguimiento", total_orders, len(orders_with_tracking))
+            return orders_with_tracking
 
-            logger.info(f"Consultando pedidos pendientes de envío: {url}")
-            response = requests.get(url, params=params, auth=self.auth, timeout=30)
-            response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            self._breaker_record_failure()
+            logger.error("Error al consultar pedidos: %s", e)
+            logger.error("Código de estado HTTP: %s", e.response.status_code)
+            return None
+        except httpx.HTTPError as e:
+            self._breaker_record_failure()
+            logger.error("Error al consultar pedidos: %s", e)
+            return None
+        except Exception as e:
+            logger.error("Error inesperado al procesar respuesta: %s", e, exc_info=True)
+            return None
+
+    def _order_from_element(self, elem: etree._Element) -> Dict[str, Any]:
+        """
+        Extrae de un nodo <order> solo los campos que usa el procesador.
+
+        La estructura devuelta (dicts con "_" y "@xlink:href" para los
+        recursos relacionados) se mantiene compatible con los lectores
+        existentes.
+
+        Args:
+            elem: Nodo <order> del XML
+
+        Returns:
+            Diccionario con los campos relevantes del pedido
+        """
+        order = {
+            "id": elem.findtext("id"),
+            "reference": elem.findtext("reference")
+        }
+
+        shipping = elem.find("shipping_number")
+        if shipping is not None:
+            order["shipping_number"] = {"_": (shipping.text or "").strip()}
+
+        for field in ("id_customer", "id_address_delivery"):
+            node = elem.find(field)
+            if node is not None:
+                order[field] = {
+                    "@xlink:href": node.get(_XLINK_HREF),
+                    "_": node.text
+                }
+
+        return order
+
+    async def _stream_orders_page(self, url: str, params: Dict[str, str]) -> tuple:
+        """
+        Descarga una página del listado con reintento corto ante 5xx/429.
+
+        El listado va por el camino streaming y no pasa por
+        _request_with_retry, así que el reintento se aplica aquí por página:
+        un 503 transitorio no debe abortar la ejecución completa.
 
-            # Verificar que hay contenido en la respuesta
-            if not response.text or response.text.strip() == "":
-                logger.warning("La API devolvió una respuesta vacía")
-                return []
+        Args:
+            url: URL del listado de pedidos
+            params: Parámetros de la página
 
-            # Parsear XML a diccionario
+        Returns:
+            Tupla (pedidos con seguimiento, total de pedidos de la página)
+        """
+        attempt = 0
+
+        while True:
             try:
-                data = xmltodict.parse(response.text)
-            except Exception as parse_error:
-                logger.error(f"Error al parsear XML: {parse_error}")
-                logger.debug(f"Respuesta recibida (primeros 500 chars): {response.text[:500]}")
-                return None
+                return await self._stream_orders(url, params)
+            except httpx.HTTPStatusError as e:
+                if (e.response.status_code in self.RETRY_STATUS
+                        and attempt < self.RETRY_ATTEMPTS):
+                    attempt += 1
+                    logger.warning("Respuesta %s del listado de pedidos, reintento %s/%s",
+                                   e.response.status_code, attempt, self.RETRY_ATTEMPTS)
+                    await asyncio.sleep(self.RETRY_WAIT * attempt)
+                    continue
+                raise
+
+    async def _stream_orders(self, url: str, params: Dict[str, str]) -> tuple:
+        """
+        Descarga y parsea el listado de pedidos en streaming.
 
-            # Normalizar estructura de órdenes
-            orders = self._normalize_orders(data)
+        El XML se alimenta a un XMLPullParser según llegan los bytes, de modo
+        que los nodos <order> se procesan (y liberan) sin esperar a tener la
+        respuesta completa en memoria. En la misma pasada se descartan los
+        pedidos sin número de seguimiento.
 
-            # Filtrar solo pedidos con número de seguimiento
-            orders_with_tracking = self._filter_orders_with_tracking(orders)
+        Args:
+            url: URL del listado de pedidos
+            params: Parámetros de la consulta
 
-            logger.info(f"Se encontraron {len(orders)} pedidos en estado 3, {len(orders_with_tracking)} con número de seguimiento")
-            return orders_with_tracking
+        Returns:
+            Tupla (pedidos con seguimiento, total de pedidos en la respuesta)
+        """
+        orders = []
+        total = 0
+        received = False
+        parser = etree.XMLPullParser(events=("end",), tag="order")
 
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error al consultar pedidos: {e}")
-            if hasattr(e, 'response') and e.response is not None:
-                logger.error(f"Código de estado HTTP: {e.response.status_code}")
-                logger.debug(f"Respuesta del servidor: {e.response.text[:500]}")
-            return None
-        except Exception as e:
-            logger.error(f"Error inesperado al procesar respuesta: {e}", exc_info=True)
-            return None
+        async with self.session.stream("GET", url, params=params) as response:
+            response.raise_for_status()
 
-    def _normalize_orders(self, data: Dict[str, Any]) -> List[Dict[str, Any]]:
+            if not self._http_version_logged:
+                self._http_version_logged = True
+                logger.info("Versión HTTP negociada con la API: %s", response.http_version)
+
+            async for chunk in response.aiter_bytes():
+                if chunk:
+                    received = True
+                parser.feed(chunk)
+
+                for _, elem in parser.read_events():
+                    total += 1
+                    order = self._order_from_element(elem)
+                    # Liberar el subárbol ya procesado
+                    elem.clear(keep_tail=True)
+
+                    if order.get("shipping_number", {}).get("_"):
+                        orders.append(order)
+                    else:
+                        logger.info("Pedido %s no tiene número de seguimiento, se omite", order.get("id"))
+
+        if not received:
+            logger.warning("La API devolvió una respuesta vacía")
+            return [], 0
+
+        # Cerrar el parser valida que el documento esté completo
+        parser.close()
+        self._breaker_record_success()
+        return orders, total
+
+    def _normalize_customer(self, customer: etree._Element) -> Dict[str, Any]:
+        """Extrae los campos relevantes de un nodo <customer>."""
+        return {
+            "id": customer.findtext("id"),
+            "firstname": customer.findtext("firstname"),
+            "lastname": customer.findtext("lastname"),
+            "email": customer.findtext("email")
+        }
+
+    def _normalize_address(self, address: etree._Element) -> Dict[str, Any]:
+        """Extrae los campos relevantes de un nodo <address>."""
+        return {
+            "id": address.findtext("id"),
+            "id_customer": address.findtext("id_customer"),
+            "address1": address.findtext("address1"),
+            "address2": address.findtext("address2"),
+            "postcode": address.findtext("postcode"),
+            "city": address.findtext("city")
+        }
+
+    async def _fetch_resources_bulk(self, resource: str, node: str,
+                                    ids: List[str]) -> Dict[str, Dict[str, Any]]:
         """
-        Normaliza la estructura de órdenes desde el XML de PrestaShop.
+        Obtiene varios recursos del mismo tipo en una sola petición usando
+        el filtro multi-id de PrestaShop (filter[id]=[a|b|c]).
 
         Args:
-            data: Datos parseados del XML
+            resource: Nombre del endpoint (customers/addresses)
+            node: Nombre del nodo XML individual (customer/address)
+            ids: IDs a consultar
 
         Returns:
-            Lista normalizada de órdenes
+            Diccionario {id: nodo} (vacío si hay error, para que el llamador
+            haga fallback al fetch individual)
         """
+        if not self._breaker_allows():
+            return {}
+
         try:
-            if not data:
-                logger.warning("Datos de entrada vacíos en _normalize_orders")
-                return []
-
-            prestashop = data.get("prestashop")
-            if not prestashop:
-                logger.warning("No se encontró nodo 'prestashop' en la respuesta XML")
-                logger.debug(f"Estructura recibida: {list(data.keys())}")
-                return []
-
-            orders_data = prestashop.get("orders")
-            if not orders_data:
-                logger.info("No se encontró nodo 'orders' en la respuesta - no hay pedidos pendientes")
-                return []
-
-            order_data = orders_data.get("order", [])
-
-            # Si es un solo pedido, convertir a lista
-            if isinstance(order_data, dict):
-                logger.debug("Se encontró un solo pedido, convirtiéndolo a lista")
-                return [order_data]
-            elif isinstance(order_data, list):
-                logger.debug(f"Se encontraron {len(order_data)} pedidos")
-                return order_data
-            else:
-                logger.warning(f"Tipo de dato inesperado para 'order': {type(order_data)}")
-                return []
+            url = f"{self.api_url}/{resource}"
+            params = {
+                "filter[id]": f"[{'|'.join(ids)}]",
+                "display": "full"
+            }
+
+            logger.debug("Consulta masiva de %s: %s ids", resource, len(ids))
+            response = await self._request_with_retry("GET", url, params=params)
+
+            root = etree.fromstring(response.content)
+            return {item.findtext("id"): item
+                    for item in root.iterfind(f".//{node}")}
 
         except Exception as e:
-            logger.error(f"Error al normalizar órdenes: {e}", exc_info=True)
-            return []
+            logger.error("Error en consulta masiva de %s: %s", resource, e)
+            return {}
+
+    async def fetch_customers_bulk(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Obtiene los datos de varios clientes en una sola petición.
+
+        Args:
+            ids: IDs de cliente
+
+        Returns:
+            Diccionario {id_cliente: datos normalizados}
+        """
+        if not ids:
+            return {}
 
-    def _filter_orders_with_tracking(self, orders: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        items = await self._fetch_resources_bulk("customers", "customer", ids)
+        return {cid: self._normalize_customer(item) for cid, item in items.items()}
+
+    async def fetch_addresses_bulk(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
         """
-        Filtra pedidos que tengan número de seguimiento.
+        Obtiene los datos de varias direcciones en una sola petición.
 
         Args:
-            orders: Lista de pedidos
+            ids: IDs de dirección
 
         Returns:
-            Lista de pedidos con número de seguimiento
+            Diccionario {id_direccion: datos normalizados}
         """
-        filtered_orders = []
-
-        for order in orders:
-            order_id = order.get("id")
-
-            # Obtener el campo shipping_number
-            shipping_number = order.get("shipping_number", {})
-
-            # Debug: Mostrar tipo y contenido del campo
-            logger.debug(f"Pedido {order_id} - shipping_number tipo: {type(shipping_number)}, valor: {shipping_number}")
-
-            # Determinar el valor del tracking según el tipo de datos
-            tracking_value = None
-
-            if isinstance(shipping_number, str):
-                # Es un string directo
-                tracking_value = shipping_number.strip()
-            elif isinstance(shipping_number, dict):
-                # Es un diccionario, buscar en diferentes claves posibles
-                # xmltodict puede usar diferentes estructuras:
-                # - "_" cuando es un valor simple
-                # - "#text" cuando el elemento XML tiene atributos
-                tracking_value = (
-                    shipping_number.get("_") or
-                    shipping_number.get("#text") or
-                    ""
-                ).strip()
-
-                # Si aún no hay valor, intentar obtener el primer valor no-atributo
-                if not tracking_value and len(shipping_number) == 1:
-                    key = list(shipping_number.keys())[0]
-                    if not key.startswith("@"):  # Ignorar atributos XML
-                        tracking_value = str(shipping_number[key]).strip()
-            elif shipping_number:
-                # Cualquier otro tipo, convertir a string
-                tracking_value = str(shipping_number).strip()
-
-            logger.debug(f"Pedido {order_id} - tracking_value extraído: '{tracking_value}'")
-
-            if tracking_value:
-                logger.debug(f"Pedido {order_id} tiene número de seguimiento: {tracking_value}")
-                filtered_orders.append(order)
-            else:
-                logger.info(f"Pedido {order_id} no tiene número de seguimiento, se omite")
-
-        return filtered_orders
-
-    def fetch_customer_data(self, customer_url: str) -> Optional[Dict[str, Any]]:
+        if not ids:
+            return {}
+
+        items = await self._fetch_resources_bulk("addresses", "address", ids)
+        return {aid: self._normalize_address(item) for aid, item in items.items()}
+
+    async def fetch_customer_data(self, customer_url: str) -> Optional[Dict[str, Any]]:
         """
         Obtiene los datos del cliente desde PrestaShop.
 
@@ -193,27 +440,32 @@ class PrestaShopService:
         Returns:
             Diccionario con datos del cliente o None si hay error
         """
+        cached = self._resource_cache.get(customer_url)
+        if cached is not None:
+            logger.debug("Cliente resuelto desde la memoización: %s", customer_url)
+            return cached
+
+        if not self._breaker_allows():
+            return None
+
         try:
-            logger.debug(f"Consultando datos del cliente: {customer_url}")
-            response = requests.get(customer_url, auth=self.auth, timeout=30)
-            response.raise_for_status()
+            logger.debug("Consultando datos del cliente: %s", customer_url)
+            response = await self._request_with_retry("GET", customer_url)
 
-            data = xmltodict.parse(response.text)
-            customer = data.get("prestashop", {}).get("customer", {})
+            customer = etree.fromstring(response.content).find(".//customer")
+            if customer is None:
+                logger.warning("No se encontró nodo 'customer' en la respuesta XML")
+                return None
 
-            # Extraer campos relevantes
-            return {
-                "id": customer.get("id"),
-                "firstname": customer.get("firstname"),
-                "lastname": customer.get("lastname"),
-                "email": customer.get("email")
-            }
+            result = self._normalize_customer(customer)
+            self._resource_cache[customer_url] = result
+            return result
 
         except Exception as e:
-            logger.error(f"Error al obtener datos del cliente: {e}")
+            logger.error("Error al obtener datos del cliente: %s", e)
             return None
 
-    def fetch_address_data(self, address_url: str) -> Optional[Dict[str, Any]]:
+    async def fetch_address_data(self, address_url: str) -> Optional[Dict[str, Any]]:
         """
         Obtiene los datos de la dirección desde PrestaShop.
 
@@ -223,33 +475,32 @@ class PrestaShopService:
         Returns:
             Diccionario con datos de la dirección o None si hay error
         """
+        cached = self._resource_cache.get(address_url)
+        if cached is not None:
+            logger.debug("Dirección resuelta desde la memoización: %s", address_url)
+            return cached
+
+        if not self._breaker_allows():
+            return None
+
         try:
-            logger.debug(f"Consultando dirección: {address_url}")
-            response = requests.get(address_url, auth=self.auth, timeout=30)
-            response.raise_for_status()
+            logger.debug("Consultando dirección: %s", address_url)
+            response = await self._request_with_retry("GET", address_url)
 
-            data = xmltodict.parse(response.text)
-            address = data.get("prestashop", {}).get("address", {})
-
-            # Extraer campos relevantes
-            id_customer = address.get("id_customer")
-            if isinstance(id_customer, dict):
-                id_customer = id_customer.get("_")
-
-            return {
-                "id": address.get("id"),
-                "id_customer": id_customer,
-                "address1": address.get("address1"),
-                "address2": address.get("address2"),
-                "postcode": address.get("postcode"),
-                "city": address.get("city")
-            }
+            address = etree.fromstring(response.content).find(".//address")
+            if address is None:
+                logger.warning("No se encontró nodo 'address' en la respuesta XML")
+                return None
+
+            result = self._normalize_address(address)
+            self._resource_cache[address_url] = result
+            return result
 
         except Exception as e:
-            logger.error(f"Error al obtener dirección: {e}")
+            logger.error("Error al obtener dirección: %s", e)
             return None
 
-    def update_order_state(self, order_id: str, new_state: int = 4) -> bool:
+    async def update_order_state(self, order_id: str, new_state: int = 4) -> bool:
         """
         Actualiza el estado del pedido en PrestaShop.
 
@@ -260,34 +511,26 @@ class PrestaShopService:
         Returns:
             True si se actualizó correctamente, False en caso contrario
         """
-        try:
-            logger.info(f"Actualizando estado del pedido {order_id} a estado {new_state}")
+        if not self._breaker_allows():
+            return False
 
-            # Crear XML para order_history
-            xml_payload = f"""<?xml version="1.0" encoding="UTF-8"?>
-<prestashop xmlns:xlink="http://www.w3.org/1999/xlink">
-    <order_history>
-        <id_order>{order_id}</id_order>
-        <id_employee>5</id_employee>
-        <id_order_state>{new_state}</id_order_state>
-    </order_history>
-</prestashop>"""
+        try:
+            logger.info("Actualizando estado del pedido %s a estado %s", order_id, new_state)
 
-            url = f"{self.api_url}/order_histories"
-            headers = {"Content-Type": "application/xml"}
+            # Rellenar el esqueleto precompilado de order_history
+            xml_payload = _ORDER_HISTORY_TEMPLATE.substitute(
+                order_id=order_id, new_state=new_state)
 
-            response = requests.post(
-                url,
-                data=xml_payload,
-                headers=headers,
-                auth=self.auth,
-                timeout=30
+            await self._request_with_retry(
+                "POST",
+                self._order_history_url,
+                content=xml_payload,
+                headers=self._xml_headers
             )
-            response.raise_for_status()
 
-            logger.info(f"Estado del pedido {order_id} actualizado correctamente")
+            logger.info("Estado del pedido %s actualizado correctamente", order_id)
             return True
 
         except Exception as e:
-            logger.error(f"Error al actualizar estado del pedido {order_id}: {e}")
+            logger.error("Error al actualizar estado del pedido %s: %s", order_id, e)
             return False